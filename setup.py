@@ -23,10 +23,12 @@ setup(
         'pillow'
     ],
     tests_require=[
-        'ghostscript'
+        'ghostscript',
+        'pypdfium2>=4; python_version >= "3.6"'
     ],
     extras_require={
-        'bindings': ['ghostscript']
+        'bindings': ['ghostscript'],
+        'pdfium': ['pypdfium2>=4']
     },
     test_suite='zplgrf.tests',
     classifiers=[
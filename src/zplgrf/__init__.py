@@ -1,10 +1,12 @@
 import base64
 import binascii
+import hashlib
 import math
 import os
 import re
 import struct
 import tempfile
+import time
 import zlib
 from ctypes import c_ushort
 from io import BytesIO
@@ -64,6 +66,17 @@ def _calculate_crc_ccitt(data):
 RE_COMPRESSED = re.compile(r'[G-Zg-z]+.')
 RE_UNCOMPRESSED = re.compile(r'((.)\2{1,})')
 RE_BINARY_SPLIT = re.compile(r'((.)\2*)')
+RE_GF_BINARY = re.compile(r'\^GFB,(\d+),')
+
+INVERT_TABLE = bytes(bytearray(range(255, -1, -1)))
+
+# Clockwise degrees to PIL's anti-clockwise transpositions
+ROTATIONS = {
+    0: None,
+    90: Image.ROTATE_270,
+    180: Image.ROTATE_180,
+    270: Image.ROTATE_90
+}
 
 
 class GRFException(Exception):
@@ -71,8 +84,15 @@ class GRFException(Exception):
 
 
 class GRFData(object):
-    def __init__(self, width, bytes=None, hex=None, bin=None):
+    def __init__(
+        self, width, bytes=None, hex=None, bin=None, pixel_width=None
+    ):
+        """
+        Width is in bytes. Rows are padded to whole bytes so pixel_width is
+        the real width in px if known.
+        """
         self._width = width
+        self._pixel_width = pixel_width
         self._bytes = None
         self._hex = None
         self._bin = None
@@ -105,6 +125,10 @@ class GRFData(object):
     def width(self):
         return self._width * 8
 
+    @property
+    def pixel_width(self):
+        return self._pixel_width or self.width
+
     @property
     def bytes_rows(self):
         return list(_chunked(self.bytes, self._width))
@@ -123,10 +147,7 @@ class GRFData(object):
             if self._hex:
                 self._bytes = binascii.unhexlify(self._hex)
             elif self._bin:
-                bytes_ = []
-                for binary in _chunked(self._bin, 8):
-                    bytes_.append(struct.pack('B', int(binary, 2)))
-                self._bytes = b''.join(bytes_)
+                self._bytes = binascii.unhexlify(self._bin_to_hex(self._bin))
         return self._bytes
 
     @property
@@ -136,29 +157,426 @@ class GRFData(object):
                 hex_ = binascii.hexlify(self._bytes).decode('ascii')
                 self._hex = hex_.upper()
             elif self._bin:
-                hex_ = []
-                for binary in _chunked(self._bin, 8):
-                    hex_.append('%02X' % int(binary, 2))
-                self._hex = ''.join(hex_)
+                self._hex = self._bin_to_hex(self._bin).upper()
         return self._hex
 
     @property
     def bin(self):
         if not self._bin:
             if self._bytes:
-                bin_ = []
-                is_string = _is_string(self._bytes)
-                for byte in self._bytes:
-                    byte = ord(byte) if is_string else byte
-                    bin_.append(bin(byte)[2:].rjust(8, '0'))
-                self._bin = ''.join(bin_)
+                hex_ = binascii.hexlify(self._bytes).decode('ascii')
+                self._bin = self._hex_to_bin(hex_)
             elif self._hex:
-                hex_ = []
-                for h in _chunked(self._hex, 2):
-                    hex_.append(bin(int(h, 16))[2:].rjust(8, '0'))
-                self._bin = ''.join(hex_)
+                self._bin = self._hex_to_bin(self._hex)
         return self._bin
 
+    # Converting through one big int runs in C instead of a Python loop per
+    # byte which matters as optimise_barcodes() converts whole images
+    # several times.
+
+    @staticmethod
+    def _bin_to_hex(bin_):
+        return '%0*x' % (len(bin_) // 4, int(bin_, 2))
+
+    @staticmethod
+    def _hex_to_bin(hex_):
+        return bin(int(hex_, 16))[2:].zfill(len(hex_) * 4)
+
+
+class PDFBackend(object):
+    """
+    Base class for the rasterisers used by GRF.from_pdf().
+
+    render() must return a list of PIL images, one per page, sized to the
+    media (width and height in points at dpi) with the page scaled to fit.
+    Pages that don't match the orientation of the media are rotated.
+
+    Backends with settings that change the output must include them in
+    cache_key() so GRFCache doesn't mix up their renders.
+    """
+
+    def cache_key(self):
+        cls = type(self)
+        return '%s.%s' % (cls.__module__, cls.__name__)
+
+    def render(
+        self, pdf, width, height, dpi, font_path=None, center_of_pixel=False
+    ):
+        raise NotImplementedError
+
+
+class GhostscriptBackend(PDFBackend):
+    """
+    - Uses subprocess.Popen
+    - Forks so there is a memory spike
+    - Easier to setup - only needs the gs binary
+    """
+
+    def _build_cmd(self, width, height, dpi, font_path, center_of_pixel):
+        # Most arguments below are based on what CUPS uses
+        setpagedevice = [
+            '/.HWMargins[0.000000 0.000000 0.000000 0.000000]',
+            '/Margins[0 0]'
+        ]
+
+        cmd = [
+            'gs',
+            '-dQUIET',
+            '-dPARANOIDSAFER',
+            '-dNOPAUSE',
+            '-dBATCH',
+            '-dNOINTERPOLATE',
+            '-sDEVICE=pngmono',
+            '-dAdvanceDistance=1000',
+            '-r%s' % int(dpi),
+            '-dDEVICEWIDTHPOINTS=%s' % int(width),
+            '-dDEVICEHEIGHTPOINTS=%s' % int(height),
+            '-dFIXEDMEDIA',
+            '-dPDFFitPage',
+            '-c',
+            '<<%s>>setpagedevice' % ' '.join(setpagedevice)
+        ]
+
+        if center_of_pixel:
+            # <= 9.21 = "0 .setfilladjust" or "0 0 .setfilladjust2"
+            # 9.22-9.26 = only "0 .setfilladjust"
+            # >= 9.27 = only "0 0 .setfilladjust2"
+            cmd += ['0 0 .setfilladjust2']
+
+        if font_path and os.path.exists(font_path):
+            cmd += ['-I' + font_path]
+
+        return cmd
+
+    def _run(self, cmd, pdf):
+        from subprocess import PIPE, Popen
+        # Ghostscript seems to be sensitive to argument order
+        cmd[13:13] += [
+            '-sstdout=%stderr',
+            '-sOutputFile=%stdout',
+        ]
+        cmd += [
+            '-f', '-'
+        ]
+        p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        pngs, stderr = p.communicate(pdf)
+        if stderr:
+            raise GRFException(stderr)
+        return pngs
+
+    def render(
+        self, pdf, width, height, dpi, font_path=None, center_of_pixel=False
+    ):
+        cmd = self._build_cmd(width, height, dpi, font_path, center_of_pixel)
+        pngs = self._run(cmd, pdf)
+
+        # This is what PIL uses to identify PNGs
+        png_start = b'\211PNG\r\n\032\n'
+
+        images = []
+        for png in pngs.split(png_start)[1:]:
+            images.append(Image.open(BytesIO(png_start + png)))
+        return images
+
+
+class GhostscriptBindingsBackend(GhostscriptBackend):
+    """
+    - Uses python-ghostscript
+    - Doesn't fork so should use less memory
+    - python-ghostscript is a bit buggy
+    - May be harder to setup - even if you have updated the gs binary
+      there may stil be old libgs* files on your system
+    """
+
+    def _run(self, cmd, pdf):
+        import ghostscript
+        # python-ghostscript doesn't like reading/writing from
+        # stdin/stdout so we need to use temp files
+        with tempfile.NamedTemporaryFile() as in_file, \
+             tempfile.NamedTemporaryFile() as out_file:
+
+            in_file.write(pdf)
+            in_file.flush()
+
+            # Ghostscript seems to be sensitive to argument order
+            cmd[13:13] += [
+                '-sOutputFile=%s' % out_file.name
+            ]
+            cmd += [
+                '-f', in_file.name
+            ]
+
+            try:
+                ghostscript.Ghostscript(*[c.encode('ascii') for c in cmd])
+            except Exception as e:
+                raise GRFException(e)
+
+            return out_file.read()
+
+
+class PdfiumBackend(PDFBackend):
+    """
+    - Uses pypdfium2
+    - Renders in process straight to a mono image so there is no fork and
+      no temp files
+    - Anti-aliasing is disabled to match Ghostscript's pngmono output
+    - Doesn't support center of pixel and raises GRFException if asked
+    - Ignores font_path as pdfium can't load extra font directories, only
+      fonts embedded in the PDF or installed on the system are used
+    """
+
+    def render(
+        self, pdf, width, height, dpi, font_path=None, center_of_pixel=False
+    ):
+        if center_of_pixel:
+            raise GRFException(
+                'The pdfium backend does not support center of pixel'
+            )
+
+        import pypdfium2
+
+        media_width = int(round(width * dpi / 72.0))
+        media_height = int(round(height * dpi / 72.0))
+
+        try:
+            document = pypdfium2.PdfDocument(pdf)
+        except pypdfium2.PdfiumError as e:
+            raise GRFException(e)
+
+        images = []
+        try:
+            for page in document:
+                try:
+                    images.append(
+                        self._render_page(page, media_width, media_height)
+                    )
+                finally:
+                    page.close()
+        finally:
+            document.close()
+
+        return images
+
+    def _render_page(self, page, media_width, media_height):
+        page_width, page_height = page.get_size()
+        rotation = 0
+        if (page_width > page_height) != (media_width > media_height):
+            # Same direction Ghostscript rotates with PDFFitPage
+            rotation = 270
+            page_width, page_height = page_height, page_width
+
+        scale = min(media_width / page_width, media_height / page_height)
+        bitmap = page.render(
+            scale=scale,
+            rotation=rotation,
+            grayscale=True,
+            no_smoothtext=True,
+            no_smoothimage=True,
+            no_smoothpath=True
+        )
+        rendered = bitmap.to_pil().point(
+            lambda p: 255 if p >= 128 else 0
+        ).convert('1')
+
+        image = Image.new('1', (media_width, media_height), 1)
+        image.paste(rendered, (
+            (media_width - rendered.size[0]) // 2,
+            (media_height - rendered.size[1]) // 2
+        ))
+        return image
+
+
+PDF_BACKENDS = {
+    'ghostscript': GhostscriptBackend,
+    'ghostscript-bindings': GhostscriptBindingsBackend,
+    'pdfium': PdfiumBackend
+}
+
+DEFAULT_PDF_BACKEND = 'ghostscript'
+
+
+def get_pdf_backend(backend=None):
+    """
+    Backend can be the name of a backend in PDF_BACKENDS, a PDFBackend
+    instance or None for the default.
+    """
+    if backend is None:
+        backend = DEFAULT_PDF_BACKEND
+    if isinstance(backend, PDFBackend):
+        return backend
+    try:
+        return PDF_BACKENDS[backend]()
+    except KeyError:
+        raise GRFException('Unknown PDF backend: %s' % backend)
+
+
+def set_default_pdf_backend(backend):
+    global DEFAULT_PDF_BACKEND
+    get_pdf_backend(backend)
+    DEFAULT_PDF_BACKEND = backend
+
+
+class GRFCache(object):
+    """
+    A persistent cache of rendered pages stored as files in a directory.
+
+    Entries are written to a temp file and renamed into place so multiple
+    processes (e.g. several CUPS filters) can share a directory. When the
+    directory grows beyond max_size bytes the least recently used entries
+    are removed.
+
+    Entries that are corrupt or from another version are treated as misses
+    and removed.
+    """
+
+    # Bump this if a change would alter the output for the same inputs
+    VERSION = 2
+
+    MAGIC = b'ZGRF'
+
+    # Temp files older than this were probably left by a killed writer
+    STALE_TMP_AGE = 3600
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have just created it
+                if not os.path.isdir(directory):
+                    raise
+
+    def make_key(self, data, **options):
+        """
+        Hash of the source data and every option which affects the output.
+        """
+        key = hashlib.sha256(data)
+        key.update(repr((self.VERSION, sorted(options.items()))).encode())
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.grf' % key)
+
+    def get(self, key):
+        """
+        Returns a list of GRFData or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file_:
+                value = file_.read()
+            # Mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        pages = self._unpack(value)
+        if pages is None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return pages
+
+    def _unpack(self, value):
+        header = struct.Struct('>4sHI')
+        page_header = struct.Struct('>III')
+
+        if len(value) < header.size:
+            return None
+        magic, version, count = header.unpack_from(value)
+        if magic != self.MAGIC or version != self.VERSION or not count:
+            return None
+
+        pages = []
+        offset = header.size
+        for i in range(count):
+            if offset + page_header.size > len(value):
+                return None
+            width, pixel_width, size = page_header.unpack_from(value, offset)
+            offset += page_header.size
+            if not width or not size or size % width:
+                return None
+            if not width * 8 - 8 < pixel_width <= width * 8:
+                return None
+            pages.append(GRFData(
+                width, bytes=value[offset:offset+size], pixel_width=pixel_width
+            ))
+            offset += size
+
+        if offset != len(value):
+            return None
+        return pages
+
+    def set(self, key, pages):
+        if not pages:
+            # Nothing rendered is more likely an error than an empty PDF
+            return
+
+        value = [struct.pack('>4sHI', self.MAGIC, self.VERSION, len(pages))]
+        for data in pages:
+            value.append(struct.pack(
+                '>III', data.width // 8, data.pixel_width, data.filesize
+            ))
+            value.append(data.bytes)
+        value = b''.join(value)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file_:
+                file_.write(value)
+                # Make sure a crash can't leave a partial entry behind
+                file_.flush()
+                os.fsync(file_.fileno())
+            # Python 2 has no os.replace but rename is atomic on POSIX
+            getattr(os, 'replace', os.rename)(tmp_path, self._path(key))
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.grf') and not name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                if now - stat.st_mtime > self.STALE_TMP_AGE:
+                    try:
+                        os.remove(path)
+                        continue
+                    except OSError:
+                        pass
+                # Still being written so count it but leave it alone
+                total += stat.st_size
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Probably already evicted by another process
+                pass
+            total -= size
+
 
 class GRF(object):
     def __init__(self, filename, data):
@@ -173,39 +591,101 @@ class GRF(object):
 
     @staticmethod
     def _normalise_zpl(zpl):
-        zpl = zpl.replace('\n', '').replace('\r', '')
-        zpl = zpl.replace('^', '\n^').replace('~', '\n~')
-        return zpl.split('\n')
+        lines = []
+        start = 0
+        while True:
+            # ^GFB data is raw binary so it may contain anything and is only
+            # delimited by its byte count
+            match = RE_GF_BINARY.search(zpl, start)
+            end = match.start() if match else len(zpl)
+            commands = zpl[start:end]
+            commands = commands.replace('\n', '').replace('\r', '')
+            commands = commands.replace('^', '\n^').replace('~', '\n~')
+            lines += commands.split('\n')
+            if not match:
+                return lines
+            header_end = match.end()
+            for i in range(2):
+                header_end = zpl.index(',', header_end) + 1
+            start = header_end + int(match.group(1))
+            lines.append(zpl[match.start():start])
+
+    @staticmethod
+    def _is_graphic_line(line):
+        return line.startswith('~DGR:') or line.startswith('^GF')
 
     @classmethod
     def replace_grfs_in_zpl(cls, zpl, optimise_barcodes=True, **kwargs):
-        map_ = {}
-        for grf in cls.from_zpl(zpl):
-            if optimise_barcodes:
-                grf.optimise_barcodes(**kwargs)
-            map_[grf.filename] = grf
         output = []
+        inline_count = 0
         for line in cls._normalise_zpl(zpl):
-            if line.startswith('~DGR:'):
-                line = map_[line.split('.')[0][5:]].to_zpl_line(**kwargs)
+            if cls._is_graphic_line(line):
+                inline = line.startswith('^GF')
+                if inline:
+                    inline_count += 1
+                grf = cls.from_zpl_line(line, 'GF%s' % inline_count)
+                if optimise_barcodes:
+                    grf.optimise_barcodes(**kwargs)
+                line = grf.to_zpl_line(inline=inline, **kwargs)
             output.append(line)
         return ''.join(output)
 
     @classmethod
     def from_zpl(cls, zpl):
+        """
+        Inline ^GF graphics have no name so they are called GF1, GF2, etc.
+        in the order they appear.
+        """
         grfs = []
+        inline_count = 0
         for line in cls._normalise_zpl(zpl):
-            if line.startswith('~DGR:'):
-                grfs.append(cls.from_zpl_line(line))
+            if cls._is_graphic_line(line):
+                if line.startswith('^GF'):
+                    inline_count += 1
+                grfs.append(cls.from_zpl_line(line, 'GF%s' % inline_count))
         return grfs
 
     @classmethod
-    def from_zpl_line(cls, line):
-        line = line[5:].split(',', 3)
-        filename = line[0][:-4]
-        filesize = int(line[1])
-        width = int(line[2])
-        data = line[3]
+    def from_zpl_line(cls, line, inline_filename='GF'):
+        """
+        Parses either a ~DGR download or an inline ^GF graphic field. The
+        latter is named inline_filename.
+        """
+        if line.startswith('^GF'):
+            format_ = line[3:4]
+            line = line[5:].split(',', 3)
+            filename = inline_filename
+            filesize = int(line[1])
+            width = int(line[2])
+            data = line[3]
+            if format_ == 'B':
+                data = data[:int(line[0])]
+                if not isinstance(data, bytes):
+                    data = data.encode('latin-1')
+            elif format_ != 'A':
+                raise GRFException(
+                    'Unsupported graphic field format: %s' % format_
+                )
+        else:
+            format_ = 'A'
+            line = line[5:].split(',', 3)
+            filename = line[0][:-4]
+            filesize = int(line[1])
+            width = int(line[2])
+            data = line[3]
+
+        if format_ == 'A':
+            data = cls._decode_ascii_data(data, width)
+
+        data = GRFData(width, bytes=data)
+
+        if data.filesize != filesize:
+            raise GRFException('Bad file size')
+
+        return cls(filename, data)
+
+    @classmethod
+    def _decode_ascii_data(cls, data, width):
         base64_encoded = False
         base64_compressed = False
         crc = None
@@ -255,19 +735,18 @@ class GRF(object):
                     row = ''
             data = b''.join(rows)
 
-        data = GRFData(width, bytes=data)
-
-        if data.filesize != filesize:
-            raise GRFException('Bad file size')
-
-        return cls(filename, data)
+        return data
 
-    def to_zpl_line(self, compression=3, **kwargs):
+    def to_zpl_line(self, compression=3, inline=False, **kwargs):
         """
         Compression:
             3 = ZB64/Z64, base64 encoded DEFLATE compressed - best compression
             2 = ASCII hex encoded run length compressed - most compatible
             1 = B64, base64 encoded - pointless?
+
+        Inline:
+            False = ~DGR download to printer storage to recall with ^XG
+            True = ^GFA graphic field to use directly in a label format
         """
         if compression == 3:
             data = base64.b64encode(zlib.compress(self.data.bytes))
@@ -311,31 +790,50 @@ class GRF(object):
 
             data = data.replace('\n', '')
 
-        zpl = '~DGR:%s.GRF,%s,%s,%s' % (
-            self.filename,
-            self.data.filesize,
-            self.data.width // 8,
-            data
-        )
+        if inline:
+            zpl = '^GFA,%s,%s,%s,%s' % (
+                self.data.filesize,
+                self.data.filesize,
+                self.data.width // 8,
+                data
+            )
+        else:
+            zpl = '~DGR:%s.GRF,%s,%s,%s' % (
+                self.filename,
+                self.data.filesize,
+                self.data.width // 8,
+                data
+            )
 
         return zpl
 
     def to_zpl(
         self, quantity=1, pause_and_cut=0, override_pause=False,
-        print_mode='C', print_orientation='N', media_tracking='Y', **kwargs
+        print_mode='C', print_orientation='N', media_tracking='Y',
+        inline=False, **kwargs
     ):
         """
         The most basic ZPL to print the GRF. Since ZPL printers are stateful
         this may not work and you may need to build your own.
+
+        inline=True embeds the image in the label with ^GF instead of
+        downloading it to printer storage, recalling it and deleting it.
         """
-        zpl = [
-            self.to_zpl_line(**kwargs),  # Download image to printer
+        zpl = []
+        if not inline:
+            zpl.append(self.to_zpl_line(**kwargs))  # Download image to printer
+        zpl += [
             '^XA',  # Start Label Format
             '^MM%s,Y' % print_mode,
             '^PO%s' % print_orientation,
             '^MN%s' % media_tracking,
             '^FO0,0',  # Field Origin to 0,0
-            '^XGR:%s.GRF,1,1' % self.filename,  # Draw image
+        ]
+        if inline:
+            zpl.append(self.to_zpl_line(inline=True, **kwargs))  # Draw image
+        else:
+            zpl.append('^XGR:%s.GRF,1,1' % self.filename)  # Draw image
+        zpl += [
             '^FS',  # Field Separator
             '^PQ%s,%s,0,%s' % (
                 int(quantity),  # Print Quantity
@@ -343,8 +841,10 @@ class GRF(object):
                 'Y' if override_pause else 'N'  # Don't pause between cuts
             ),
             '^XZ',  # End Label Format
-            '^XA^IDR:%s.GRF^FS^XZ' % self.filename  # Delete image from printer
         ]
+        if not inline:
+            # Delete image from printer
+            zpl.append('^XA^IDR:%s.GRF^FS^XZ' % self.filename)
         return ''.join(zpl)
 
     @classmethod
@@ -353,17 +853,24 @@ class GRF(object):
         Filename is 1-8 alphanumeric characters to identify the GRF in ZPL.
         """
 
-        source = Image.open(BytesIO(image))
-        source = source.convert('1')
-        width = int(math.ceil(source.size[0] / 8.0))
+        return cls._from_pil_image(Image.open(BytesIO(image)), filename)
 
-        data = []
-        for line in _chunked(list(source.getdata()), source.size[0]):
-            row = ''.join(['0' if p else '1' for p in line])
-            row = row.ljust(width * 8, '0')
-            data.append(row)
-        data = GRFData(width, bin=''.join(data))
+    @classmethod
+    def _from_pil_image(cls, image, filename):
+        image = image.convert('1')
+        width = int(math.ceil(image.size[0] / 8.0))
 
+        # PIL packs mode 1 images as 1 = white so invert to get 1 = black
+        data = bytearray(image.tobytes().translate(INVERT_TABLE))
+
+        # Rows are padded to whole bytes and the padding is now black
+        padding = width * 8 - image.size[0]
+        if padding:
+            mask = (0xFF << padding) & 0xFF
+            for i in range(width - 1, len(data), width):
+                data[i] &= mask
+
+        data = GRFData(width, bytes=bytes(data), pixel_width=image.size[0])
         return cls(filename, data)
 
     def to_image(self):
@@ -383,7 +890,8 @@ class GRF(object):
     @classmethod
     def from_pdf(
         cls, pdf, filename, width=288, height=432, dpi=203, font_path=None,
-        center_of_pixel=False, use_bindings=False
+        center_of_pixel=False, use_bindings=False, backend=None,
+        optimise_barcodes=False, optimise_options=None, cache=None
     ):
         """
         Filename is 1-8 alphanumeric characters to identify the GRF in ZPL.
@@ -394,117 +902,119 @@ class GRF(object):
         Using center of pixel will improve barcode quality but may decrease
         the quality of some text.
 
-        use_bindings=False:
-            - Uses subprocess.Popen
-            - Forks so there is a memory spike
-            - Easier to setup - only needs the gs binary
-
-        use_bindings=True:
-            - Uses python-ghostscript
-            - Doesn't fork so should use less memory
-            - python-ghostscript is a bit buggy
-            - May be harder to setup - even if you have updated the gs binary
-              there may stil be old libgs* files on your system
-        """
+        backend is the name of a registered rasteriser (see PDF_BACKENDS) or
+        a PDFBackend instance. If not given the default set with
+        set_default_pdf_backend() is used.
 
-        # Most arguments below are based on what CUPS uses
-        setpagedevice = [
-            '/.HWMargins[0.000000 0.000000 0.000000 0.000000]',
-            '/Margins[0 0]'
-        ]
+        use_bindings=True is a shortcut for backend='ghostscript-bindings'.
 
-        cmd = [
-            'gs',
-            '-dQUIET',
-            '-dPARANOIDSAFER',
-            '-dNOPAUSE',
-            '-dBATCH',
-            '-dNOINTERPOLATE',
-            '-sDEVICE=pngmono',
-            '-dAdvanceDistance=1000',
-            '-r%s' % int(dpi),
-            '-dDEVICEWIDTHPOINTS=%s' % int(width),
-            '-dDEVICEHEIGHTPOINTS=%s' % int(height),
-            '-dFIXEDMEDIA',
-            '-dPDFFitPage',
-            '-c',
-            '<<%s>>setpagedevice' % ' '.join(setpagedevice)
-        ]
+        optimise_barcodes=True runs optimise_barcodes() on every page with
+        optimise_options as its kwargs. This is mostly useful with a cache.
 
-        if center_of_pixel:
-            # <= 9.21 = "0 .setfilladjust" or "0 0 .setfilladjust2"
-            # 9.22-9.26 = only "0 .setfilladjust"
-            # >= 9.27 = only "0 0 .setfilladjust2"
-            cmd += ['0 0 .setfilladjust2']
+        cache is a GRFCache. Pages are stored after optimisation so a reprint
+        of the same PDF with the same options skips both steps.
+        """
 
-        if font_path and os.path.exists(font_path):
-            cmd += ['-I' + font_path]
+        if backend is None and use_bindings:
+            backend = 'ghostscript-bindings'
+        backend = get_pdf_backend(backend)
+
+        if optimise_options and not optimise_barcodes:
+            raise GRFException(
+                'optimise_options requires optimise_barcodes=True'
+            )
+        optimise_options = optimise_options or {}
+
+        if cache is not None:
+            key = cache.make_key(
+                pdf, width=int(width), height=int(height), dpi=int(dpi),
+                font_path=font_path, center_of_pixel=bool(center_of_pixel),
+                backend=backend.cache_key(),
+                optimise_barcodes=bool(optimise_barcodes),
+                optimise_options=sorted(optimise_options.items())
+            )
+            pages = cache.get(key)
+            if pages is not None:
+                return [cls(filename, data) for data in pages]
+
+        images = backend.render(
+            pdf, width=width, height=height, dpi=dpi, font_path=font_path,
+            center_of_pixel=center_of_pixel
+        )
 
-        if use_bindings:
-            import ghostscript
-            # python-ghostscript doesn't like reading/writing from
-            # stdin/stdout so we need to use temp files
-            with tempfile.NamedTemporaryFile() as in_file, \
-                 tempfile.NamedTemporaryFile() as out_file:
+        grfs = [cls._from_pil_image(image, filename) for image in images]
+        if optimise_barcodes:
+            for grf in grfs:
+                grf.optimise_barcodes(**optimise_options)
 
-                in_file.write(pdf)
-                in_file.flush()
+        if cache is not None:
+            cache.set(key, [grf.data for grf in grfs])
 
-                # Ghostscript seems to be sensitive to argument order
-                cmd[13:13] += [
-                    '-sOutputFile=%s' % out_file.name
-                ]
-                cmd += [
-                    '-f', in_file.name
-                ]
+        return grfs
 
-                try:
-                    ghostscript.Ghostscript(*[c.encode('ascii') for c in cmd])
-                except Exception as e:
-                    raise GRFException(e)
+    def _transpose(self, method, width=None):
+        # Only the geometry changes so there's no need to invert the bits
+        image = Image.frombytes(
+            '1', (self.data.width, self.data.height), self.data.bytes
+        )
+        # Crop off the row padding so it doesn't become part of the image
+        width = width or self.data.pixel_width
+        image = image.crop((0, 0, width, image.size[1]))
+        image = image.transpose(method)
+        self.data = GRFData(
+            int(math.ceil(image.size[0] / 8.0)), bytes=image.tobytes(),
+            pixel_width=image.size[0]
+        )
 
-                pngs = out_file.read()
-        else:
-            from subprocess import PIPE, Popen
-            # Ghostscript seems to be sensitive to argument order
-            cmd[13:13] += [
-                '-sstdout=%stderr',
-                '-sOutputFile=%stdout',
-            ]
-            cmd += [
-                '-f', '-'
-            ]
-            p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            pngs, stderr = p.communicate(pdf)
-            if stderr:
-                raise GRFException(stderr)
+    def rotate(self, degrees, width=None):
+        """
+        Rotate clockwise by 90, 180 or 270 degrees.
 
-        # This is what PIL uses to identify PNGs
-        png_start = b'\211PNG\r\n\032\n'
+        Rows are padded to whole bytes. GRFs from images and PDFs remember
+        their real width so the padding stays on the right. GRFs from ZPL
+        don't so pass width in px if it isn't a multiple of 8, otherwise the
+        content moves by up to 7px.
+        """
+        try:
+            method = ROTATIONS[degrees % 360]
+        except KeyError:
+            raise GRFException('Rotation must be a multiple of 90 degrees')
+        if method is not None:
+            self._transpose(method, width)
+
+    def mirror(self, width=None):
+        """
+        Flip left to right.
 
-        grfs = []
-        for png in pngs.split(png_start)[1:]:
-            grfs.append(cls.from_image(png_start + png, filename))
-        return grfs
+        Width is the same as for rotate().
+        """
+        self._transpose(Image.FLIP_LEFT_RIGHT, width)
 
-    def _rotate_data(self, data, clockwise=True):
-        data = [list(d) for d in data]
-        if clockwise:
-            data = list(zip(*data[::-1]))
-        else:
-            data = list(zip(*data))[::-1]
-        return [''.join(d) for d in data]
+    def flip(self):
+        """
+        Flip top to bottom.
+        """
+        self._transpose(Image.FLIP_TOP_BOTTOM)
+
+    def _set_bin_rows(self, rows):
+        self.data = GRFData(
+            self.data.width // 8, bin=''.join(rows),
+            pixel_width=self.data.pixel_width
+        )
 
     def optimise_barcodes(self, **kwargs):
+        # The whole image is converted between bytes and bits several times
+        # so GRFData's conversions must stay cheap.
+
         # Optimise vertical barcodes
         data = self._optimise_barcodes(self.data.bin_rows, **kwargs)
+        self._set_bin_rows(data)
 
         # Optimise horizontal barcodes
-        data = self._rotate_data(data, True)
-        data = self._optimise_barcodes(data, **kwargs)
-        data = self._rotate_data(data, False)
-
-        self.data = GRFData(self.data.width // 8, bin=''.join(data))
+        self.rotate(90)
+        data = self._optimise_barcodes(self.data.bin_rows, **kwargs)
+        self._set_bin_rows(data)
+        self.rotate(270)
 
     def _optimise_barcodes(
         self, data, min_bar_height=20, min_bar_count=100, max_gap_size=30,
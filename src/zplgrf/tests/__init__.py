@@ -1,11 +1,41 @@
+import binascii
+import hashlib
+import math
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 from io import BytesIO
 
-from zplgrf import GRF
+from PIL import Image
 
+from zplgrf import (
+    GRF, GRFCache, GRFData, GRFException, PDFBackend, PdfiumBackend,
+    get_pdf_backend, set_default_pdf_backend
+)
 
-class TestStringMethods(unittest.TestCase):
+
+class ImageBackend(PDFBackend):
+    """
+    Returns the same image for every render and counts the calls.
+    """
+    def __init__(self, image):
+        self.image = image
+        self.calls = 0
+
+    def cache_key(self):
+        return (
+            super(ImageBackend, self).cache_key(),
+            hashlib.sha256(self.image).hexdigest()
+        )
+
+    def render(self, pdf, **kwargs):
+        self.calls += 1
+        return [Image.open(BytesIO(self.image))]
+
+
+class ZPLGRFTestCase(unittest.TestCase):
     def _read_file(self, file_):
         mode = 'r' if file_.endswith('.zpl') else 'rb'
         input_dir = os.path.join(os.path.dirname(__file__), 'input')
@@ -15,34 +45,75 @@ class TestStringMethods(unittest.TestCase):
     def _compare(self, a, b):
         self.assertEqual(a, self._read_file(b))
 
+
+class PDFBackendTests(object):
+    """
+    Every backend must pass these. Backends don't rasterise identically so
+    each may have its own goldens, named with golden_suffix.
+    """
+    backend = None
+    golden_suffix = ''
+
+    def _golden(self, file_):
+        name, ext = os.path.splitext(file_)
+        return name + self.golden_suffix + ext
+
     def test_pdf_to_image(self):
-        grf = GRF.from_pdf(self._read_file('pdf.pdf'), 'TEST')[0]
+        grf = GRF.from_pdf(
+            self._read_file('pdf.pdf'), 'TEST', backend=self.backend
+        )[0]
 
         output = BytesIO()
         grf.to_image().save(output, 'PNG')
-        self._compare(output.getvalue(), 'pdf-image.png')
+        self._compare(output.getvalue(), self._golden('pdf-image.png'))
 
         output = BytesIO()
         grf.optimise_barcodes()
         grf.to_image().save(output, 'PNG')
-        self._compare(output.getvalue(), 'pdf-optimised-image.png')
+        self._compare(
+            output.getvalue(), self._golden('pdf-optimised-image.png')
+        )
 
     def test_pdf_to_image_multiple_pages(self):
-        grfs = GRF.from_pdf(self._read_file('pdf-2pages.pdf'), 'TEST')
+        grfs = GRF.from_pdf(
+            self._read_file('pdf-2pages.pdf'), 'TEST', backend=self.backend
+        )
 
         self.assertEqual(len(grfs), 2)
 
         for i, grf in enumerate(grfs):
             output = BytesIO()
             grf.to_image().save(output, 'PNG')
-            self._compare(output.getvalue(), 'pdf-2pages-%i.png' % i)
+            self._compare(
+                output.getvalue(), self._golden('pdf-2pages-%i.png' % i)
+            )
 
     def test_pdf_landscape(self):
-        grf = GRF.from_pdf(self._read_file('pdf-landscape.pdf'), 'TEST')[0]
+        grf = GRF.from_pdf(
+            self._read_file('pdf-landscape.pdf'), 'TEST', backend=self.backend
+        )[0]
         output = BytesIO()
         grf.to_image().save(output, 'PNG')
-        self._compare(output.getvalue(), 'pdf-landscape.png')
+        self._compare(output.getvalue(), self._golden('pdf-landscape.png'))
+
+
+class TestGhostscriptBackend(PDFBackendTests, ZPLGRFTestCase):
+    backend = 'ghostscript'
+
 
+class TestGhostscriptBindingsBackend(PDFBackendTests, ZPLGRFTestCase):
+    backend = 'ghostscript-bindings'
+
+
+@unittest.skipIf(
+    sys.version_info < (3, 6), 'pypdfium2 requires Python 3.6+'
+)
+class TestPdfiumBackend(PDFBackendTests, ZPLGRFTestCase):
+    backend = 'pdfium'
+    golden_suffix = '-pdfium'
+
+
+class TestStringMethods(ZPLGRFTestCase):
     def test_image_to_zpl(self):
         grf = GRF.from_image(self._read_file('pdf-image.png'), 'TEST')
         grf.optimise_barcodes()
@@ -77,18 +148,9 @@ class TestStringMethods(unittest.TestCase):
         grf.to_image().save(output, 'PNG')
         self._compare(output.getvalue(), 'pdf-image-centerofpixel.png')
 
-    def test_pdf_to_image_using_bindings(self):
-        grfs = GRF.from_pdf(
-            self._read_file('pdf-2pages.pdf'), 'TEST', use_bindings=True
-        )
-
-        self.assertEqual(len(grfs), 2)
-
-        for i, grf in enumerate(grfs):
-            output = BytesIO()
-            grf.to_image().save(output, 'PNG')
-            self._compare(output.getvalue(), 'pdf-2pages-%i.png' % i)
-
+    def test_ghostscript_center_of_pixel_using_bindings(self):
+        # The rest of the bindings backend is covered by
+        # TestGhostscriptBindingsBackend
         grf = GRF.from_pdf(
             self._read_file('pdf.pdf'), 'TEST', center_of_pixel=True,
             use_bindings=True
@@ -103,3 +165,235 @@ class TestStringMethods(unittest.TestCase):
         output = BytesIO()
         grf.to_image().save(output, 'PNG')
         self._compare(output.getvalue(), 'pdf-optimised-image.png')
+
+    def test_pdf_backend_selection(self):
+        self.assertIsInstance(get_pdf_backend('pdfium'), PdfiumBackend)
+        backend = PdfiumBackend()
+        self.assertIs(get_pdf_backend(backend), backend)
+        with self.assertRaises(GRFException):
+            get_pdf_backend('nonexistent')
+        with self.assertRaises(GRFException):
+            set_default_pdf_backend('nonexistent')
+
+        set_default_pdf_backend('pdfium')
+        try:
+            self.assertIsInstance(get_pdf_backend(), PdfiumBackend)
+        finally:
+            set_default_pdf_backend('ghostscript')
+
+    def test_pdfium_center_of_pixel_unsupported(self):
+        with self.assertRaises(GRFException):
+            GRF.from_pdf(
+                self._read_file('pdf.pdf'), 'TEST', center_of_pixel=True,
+                backend='pdfium'
+            )
+
+    def test_pdf_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = GRFCache(directory)
+        backend = ImageBackend(self._read_file('pdf-image.png'))
+        pdf = self._read_file('pdf.pdf')
+
+        for i in range(2):
+            grf = GRF.from_pdf(
+                pdf, 'TEST', backend=backend, optimise_barcodes=True,
+                cache=cache
+            )[0]
+            output = BytesIO()
+            grf.to_image().save(output, 'PNG')
+            self._compare(output.getvalue(), 'pdf-optimised-image.png')
+        self.assertEqual(backend.calls, 1)
+
+        # The real width survives the cache
+        cache.set('width', [GRFData(2, bytes=b'\xff\xc0', pixel_width=10)])
+        self.assertEqual(cache.get('width')[0].pixel_width, 10)
+
+        # Any change in options is a different entry
+        GRF.from_pdf(
+            pdf, 'TEST', backend=backend, optimise_barcodes=True, cache=cache,
+            optimise_options={'min_bar_height': 10}
+        )
+        GRF.from_pdf(pdf, 'TEST', backend=backend, dpi=300, cache=cache)
+        self.assertEqual(backend.calls, 3)
+
+        # Backends with different settings don't share entries
+        other = ImageBackend(self._read_file('pdf-optimised-image.png'))
+        grf = GRF.from_pdf(pdf, 'TEST', backend=other, cache=cache)[0]
+        self.assertEqual(other.calls, 1)
+        output = BytesIO()
+        grf.to_image().save(output, 'PNG')
+        self._compare(output.getvalue(), 'pdf-optimised-image.png')
+
+    def test_pdf_cache_eviction(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backend = ImageBackend(self._read_file('pdf-image.png'))
+        pdf = self._read_file('pdf.pdf')
+
+        # Only room for one entry with its headers
+        size = len(GRF.from_image(backend.image, 'TEST').data.bytes) + 22
+        cache = GRFCache(directory, max_size=size)
+
+        GRF.from_pdf(pdf, 'TEST', backend=backend, cache=cache)
+        GRF.from_pdf(pdf, 'TEST', backend=backend, dpi=300, cache=cache)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        GRF.from_pdf(pdf, 'TEST', backend=backend, dpi=300, cache=cache)
+        self.assertEqual(backend.calls, 2)
+        GRF.from_pdf(pdf, 'TEST', backend=backend, cache=cache)
+        self.assertEqual(backend.calls, 3)
+
+        # Temp files left by killed writers are cleaned up
+        stale = os.path.join(directory, 'stale.tmp')
+        with open(stale, 'wb') as file_:
+            file_.write(b'0')
+        os.utime(stale, (0, 0))
+        GRF.from_pdf(pdf, 'TEST', backend=backend, dpi=300, cache=cache)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_pdf_cache_corrupt(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = GRFCache(directory)
+        backend = ImageBackend(self._read_file('pdf-image.png'))
+        pdf = self._read_file('pdf.pdf')
+
+        GRF.from_pdf(pdf, 'TEST', backend=backend, cache=cache)
+        path = os.path.join(directory, os.listdir(directory)[0])
+        with open(path, 'rb') as file_:
+            value = file_.read()
+
+        for corrupt in (b'', value[:-1], value[:12], b'XXXX' + value[4:]):
+            with open(path, 'wb') as file_:
+                file_.write(corrupt)
+            calls = backend.calls
+            grfs = GRF.from_pdf(pdf, 'TEST', backend=backend, cache=cache)
+            self.assertEqual(len(grfs), 1)
+            self.assertEqual(backend.calls, calls + 1)
+            with open(path, 'rb') as file_:
+                self.assertEqual(file_.read(), value)
+
+    def test_pdf_optimise_options(self):
+        backend = ImageBackend(self._read_file('pdf-image.png'))
+        pdf = self._read_file('pdf.pdf')
+        with self.assertRaises(GRFException):
+            GRF.from_pdf(
+                pdf, 'TEST', backend=backend,
+                optimise_options={'min_bar_height': 10}
+            )
+        with self.assertRaises(TypeError):
+            GRF.from_pdf(pdf, 'TEST', backend=backend, use_binding=True)
+
+    def test_inline_zpl(self):
+        grf = GRF.from_zpl(self._read_file('pdf-asciihex.zpl'))[0]
+        for compression in (1, 2, 3):
+            zpl = grf.to_zpl(inline=True, compression=compression)
+            self.assertNotIn('~DGR', zpl)
+            self.assertNotIn('^IDR', zpl)
+            inline_grfs = GRF.from_zpl(zpl)
+            self.assertEqual(len(inline_grfs), 1)
+            self.assertEqual(inline_grfs[0].filename, 'GF1')
+            self.assertEqual(inline_grfs[0].data.bytes, grf.data.bytes)
+
+        zpl = GRF.replace_grfs_in_zpl(grf.to_zpl(inline=True, compression=2))
+        grf.optimise_barcodes()
+        self.assertEqual(zpl, grf.to_zpl(inline=True))
+
+    def test_inline_binary_zpl(self):
+        # Raw data can contain anything including ZPL control characters
+        data = b'^XZ~\r\n\x00\xff' + b',:' * 4
+        grf = GRF.from_zpl(
+            '^XA^FO0,0^GFA,16,16,4,%s^FS^XZ' %
+            binascii.hexlify(data).decode('ascii')
+        )[0]
+        zpl = '^XA^FO0,0^GFB,16,16,4,%s^FS^XZ' % data.decode('latin-1')
+        self.assertEqual(GRF.from_zpl(zpl)[0].data.bytes, data)
+        self.assertEqual(
+            GRF.replace_grfs_in_zpl(zpl, optimise_barcodes=False),
+            '^XA^FO0,0%s^FS^XZ' % grf.to_zpl_line(inline=True)
+        )
+
+        with self.assertRaises(GRFException):
+            GRF.from_zpl('^XA^FO0,0^GFC,1,1,1,0^FS^XZ')
+
+    def test_rotate_and_mirror(self):
+        source = Image.open(BytesIO(self._read_file('pdf-image.png')))
+        source = source.convert('1')
+
+        for degrees, method in (
+            (90, Image.ROTATE_270),
+            (180, Image.ROTATE_180),
+            (270, Image.ROTATE_90)
+        ):
+            grf = GRF.from_image(self._read_file('pdf-image.png'), 'TEST')
+            grf.rotate(degrees)
+            expected = source.transpose(method)
+            # Rotating pads the new rows to whole bytes
+            self.assertEqual(
+                grf.data.width, int(math.ceil(expected.size[0] / 8.0)) * 8
+            )
+            image = grf.to_image().crop((0, 0) + expected.size)
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+        grf = GRF.from_image(self._read_file('pdf-image.png'), 'TEST')
+        grf.mirror()
+        self.assertEqual(
+            grf.to_image().tobytes(),
+            source.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+        )
+        grf.flip()
+        grf.rotate(180)
+        self.assertEqual(grf.to_image().tobytes(), source.tobytes())
+
+        with self.assertRaises(GRFException):
+            grf.rotate(45)
+
+    def test_rotate_and_mirror_unaligned(self):
+        # 10px wide so each row is padded with 6px
+        source = Image.new('1', (10, 3), 1)
+        source.putpixel((0, 0), 0)
+        source.putpixel((9, 2), 0)
+        output = BytesIO()
+        source.save(output, 'PNG')
+        original = GRF.from_image(output.getvalue(), 'TEST')
+        self.assertEqual(original.data.pixel_width, 10)
+
+        grf = GRF.from_image(output.getvalue(), 'TEST')
+        grf.mirror()
+        self.assertEqual(
+            grf.to_image().crop((0, 0, 10, 3)).tobytes(),
+            source.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+        )
+        grf.mirror()
+        self.assertEqual(grf.data.bytes, original.data.bytes)
+
+        grf = GRF.from_image(output.getvalue(), 'TEST')
+        grf.rotate(270)
+        self.assertEqual((grf.data.width, grf.data.height), (8, 10))
+        self.assertEqual(grf.data.pixel_width, 3)
+        self.assertEqual(
+            grf.to_image().crop((0, 0, 3, 10)).tobytes(),
+            source.transpose(Image.ROTATE_90).tobytes()
+        )
+        grf.rotate(90)
+        self.assertEqual(grf.data.bytes, original.data.bytes)
+
+        grf.optimise_barcodes()
+        self.assertEqual(grf.data.pixel_width, 10)
+
+        # GRFs from ZPL don't know their real width so it can be given
+        grf = GRF.from_zpl(original.to_zpl())[0]
+        self.assertEqual(grf.data.pixel_width, 16)
+        grf.mirror(width=10)
+        self.assertEqual(
+            grf.to_image().crop((0, 0, 10, 3)).tobytes(),
+            source.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+        )
+
+    def test_data_conversions(self):
+        data = b'\x00\x01\x80\xff\x5a\x00'
+        bin_ = '000000000000000110000000111111110101101000000000'
+        self.assertEqual(GRFData(3, bytes=data).bin, bin_)
+        self.assertEqual(GRFData(3, bin=bin_).bytes, data)
+        self.assertEqual(GRFData(3, bin=bin_).hex, '000180FF5A00')
+        self.assertEqual(GRFData(3, hex='000180FF5A00').bin, bin_)